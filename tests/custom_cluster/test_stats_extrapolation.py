@@ -15,6 +15,7 @@
 # specific language governing permissions and limitations
 # under the License.
 
+from multiprocessing.pool import ThreadPool
 from os import path
 from tests.common.custom_cluster_test_suite import CustomClusterTestSuite
 from tests.common.test_dimensions import (
@@ -50,13 +51,21 @@ class TestStatsExtrapolation(CustomClusterTestSuite):
     COMPUTE STATS TABLESAMPLE computes in-the-right-ballpark stats and successfully
     stores them in the HMS."""
 
+    # Maps from (stats kind, expected table) to the SHOW STATS result of the expected
+    # table. The expected tables are not modified by the sampling runs, so their stats
+    # only need to be fetched once.
+    self.__expected_stats_cache = {}
+
+    # Each (perc, seed) combination is sampled on its own clone of the source table so
+    # that the sampling runs are independent of each other and can run concurrently.
+    sampling_params = [(1, 3), (10, 7), (20, 13), (100, 99)]
+    sampling_tests = []
+
     # Test partitioned table.
-    part_test_tbl = unique_database + ".alltypes"
-    self.clone_table("functional.alltypes", part_test_tbl, True, vector)
-    self.__run_sampling_test(part_test_tbl, "functional.alltypes", 1, 3)
-    self.__run_sampling_test(part_test_tbl, "functional.alltypes", 10, 7)
-    self.__run_sampling_test(part_test_tbl, "functional.alltypes", 20, 13)
-    self.__run_sampling_test(part_test_tbl, "functional.alltypes", 100, 99)
+    for perc, seed in sampling_params:
+      part_test_tbl = "{0}.alltypes_p{1}".format(unique_database, perc)
+      self.clone_table("functional.alltypes", part_test_tbl, True, vector)
+      sampling_tests.append((part_test_tbl, "functional.alltypes", perc, seed))
 
     # Test unpartitioned table.
     nopart_test_tbl = unique_database + ".alltypesnopart"
@@ -66,72 +75,130 @@ class TestStatsExtrapolation(CustomClusterTestSuite):
     nopart_test_tbl_exp = unique_database + ".alltypesnopart_exp"
     self.clone_table(nopart_test_tbl, nopart_test_tbl_exp, False, vector)
     self.client.execute("compute stats {0}".format(nopart_test_tbl_exp))
-    self.__run_sampling_test(nopart_test_tbl, nopart_test_tbl_exp, 1, 3)
-    self.__run_sampling_test(nopart_test_tbl, nopart_test_tbl_exp, 10, 7)
-    self.__run_sampling_test(nopart_test_tbl, nopart_test_tbl_exp, 20, 13)
-    self.__run_sampling_test(nopart_test_tbl, nopart_test_tbl_exp, 100, 99)
+    for perc, seed in sampling_params:
+      nopart_sample_tbl = "{0}.alltypesnopart_p{1}".format(unique_database, perc)
+      self.clone_table(nopart_test_tbl, nopart_sample_tbl, False, vector)
+      sampling_tests.append((nopart_sample_tbl, nopart_test_tbl_exp, perc, seed))
+
+    self.__run_sampling_tests_in_parallel(sampling_tests)
 
     # Test empty table.
     empty_test_tbl = unique_database + ".empty"
     self.clone_table("functional.alltypes", empty_test_tbl, False, vector)
-    self.__run_sampling_test(empty_test_tbl, empty_test_tbl, 10, 7)
+    self.__run_sampling_test(self.client, empty_test_tbl, empty_test_tbl, 10, 7)
 
     # Test wide table. Should not crash or error. This takes a few minutes so restrict
-    # to exhaustive.
+    # to exhaustive. The statement under test is the COMPUTE STATS itself, so its result
+    # must not be reused from a previous run.
     if self.exploration_strategy() == "exhaustive":
       wide_test_tbl = unique_database + ".wide"
       self.clone_table("functional.widetable_1000_cols", wide_test_tbl, False, vector)
       self.client.execute(
         "compute stats {0} tablesample system(10)".format(wide_test_tbl))
 
-  def __run_sampling_test(self, tbl, expected_tbl, perc, seed):
+  def __run_sampling_tests_in_parallel(self, sampling_tests, parallelism=4):
+    """Runs __run_sampling_test() concurrently for each (tbl, expected_tbl, perc, seed)
+    tuple in 'sampling_tests' using a pool of 'parallelism' threads. Each run uses a
+    dedicated client. The 'tbl' of every tuple must be distinct because each run drops
+    and recomputes the stats of its 'tbl'."""
+    pool = ThreadPool(processes=parallelism)
+    try:
+      results = [pool.apply_async(self.__run_sampling_test_with_new_client, args)
+                 for args in sampling_tests]
+      # Wait for all sampling tests to finish and propagate any failures.
+      for r in results:
+        r.get()
+    finally:
+      pool.terminate()
+
+  def __run_sampling_test_with_new_client(self, tbl, expected_tbl, perc, seed):
+    """Runs __run_sampling_test() using a new client."""
+    client = self.create_impala_client()
+    try:
+      self.__run_sampling_test(client, tbl, expected_tbl, perc, seed)
+    finally:
+      client.close()
+
+  def __run_sampling_test(self, client, tbl, expected_tbl, perc, seed):
     """Drops stats on 'tbl' and then runs COMPUTE STATS TABLESAMPLE on 'tbl' with the
     given sampling percent and random seed. Checks that the resulting table and column
-    stats are reasoanbly close to those of 'expected_tbl'."""
-    self.client.execute("drop stats {0}".format(tbl))
-    self.client.execute("compute stats {0} tablesample system ({1}) repeatable ({2})"\
+    stats are reasoanbly close to those of 'expected_tbl'. All statements are issued
+    through 'client'."""
+    client.execute("drop stats {0}".format(tbl))
+    client.execute("compute stats {0} tablesample system ({1}) repeatable ({2})"\
       .format(tbl, perc, seed))
-    self.__check_table_stats(tbl, expected_tbl)
-    self.__check_column_stats(tbl, expected_tbl)
+    self.__check_table_stats(client, tbl, expected_tbl)
+    self.__check_column_stats(client, tbl, expected_tbl)
+
+  def __get_expected_stats(self, client, kind, tbl, expected_tbl):
+    """Returns the result of SHOW 'kind' STATS on 'expected_tbl', where 'kind' is either
+    "table" or "column". The result is cached unless 'expected_tbl' is the table being
+    sampled, in which case its stats change with every run."""
+    stmt = "show {0} stats {1}".format(kind, expected_tbl)
+    if tbl == expected_tbl: return client.execute(stmt)
+    key = (kind, expected_tbl)
+    if key not in self.__expected_stats_cache:
+      self.__expected_stats_cache[key] = client.execute(stmt)
+    return self.__expected_stats_cache[key]
 
-  def __check_table_stats(self, tbl, expected_tbl):
+  def __check_table_stats(self, client, tbl, expected_tbl):
     """Checks that the row counts reported in SHOW TABLE STATS on 'tbl' are within 2x
     of those reported for 'expected_tbl'. Assumes that COMPUTE STATS was previously run
     on 'expected_table' and that COMPUTE STATS TABLESAMPLE was run on 'tbl'."""
-    actual = self.client.execute("show table stats {0}".format(tbl))
-    expected = self.client.execute("show table stats {0}".format(expected_tbl))
+    actual = client.execute("show table stats {0}".format(tbl))
+    expected = self.__get_expected_stats(client, "table", tbl, expected_tbl)
     assert len(actual.data) == len(expected.data)
     assert len(actual.schema.fieldSchemas) == len(expected.schema.fieldSchemas)
     col_names = [fs.name.upper() for fs in actual.schema.fieldSchemas]
     rows_col_idx = col_names.index("#ROWS")
     extrap_rows_col_idx = col_names.index("EXTRAP #ROWS")
-    for i in xrange(0, len(actual.data)):
-      act_cols = actual.data[i].split("\t")
-      exp_cols = expected.data[i].split("\t")
-      assert int(exp_cols[rows_col_idx]) >= 0
-      self.appx_equals(\
-        int(act_cols[extrap_rows_col_idx]), int(exp_cols[rows_col_idx]), 2)
-      # Only the table-level row count is stored. The partition row counts
-      # are extrapolated.
+    # Only split off the leading columns that are actually read.
+    act_max_splits = max(rows_col_idx, extrap_rows_col_idx) + 1
+    exp_max_splits = rows_col_idx + 1
+    act_rows = [row.split("\t", act_max_splits) for row in actual.data]
+    exp_rows = [row.split("\t", exp_max_splits) for row in expected.data]
+    act_row_counts = [int(cols[rows_col_idx]) for cols in act_rows]
+    act_extrap_row_counts = [int(cols[extrap_rows_col_idx]) for cols in act_rows]
+    exp_row_counts = [int(cols[rows_col_idx]) for cols in exp_rows]
+    assert all(c >= 0 for c in exp_row_counts), exp_row_counts
+    self.__assert_all_appx_equals(act_extrap_row_counts, exp_row_counts, 2)
+    # Only the table-level row count is stored. The partition row counts
+    # are extrapolated.
+    act_total_row_counts = []
+    exp_total_row_counts = []
+    partition_row_counts = []
+    for act_cols, act_count, exp_count in zip(act_rows, act_row_counts, exp_row_counts):
       if act_cols[0] == "Total":
-        self.appx_equals(
-          int(act_cols[rows_col_idx]), int(exp_cols[rows_col_idx]), 2)
-      elif len(actual.data) > 1:
-        # Partition row count is expected to not be set.
-        assert int(act_cols[rows_col_idx]) == -1
+        act_total_row_counts.append(act_count)
+        exp_total_row_counts.append(exp_count)
+      else:
+        partition_row_counts.append(act_count)
+    self.__assert_all_appx_equals(act_total_row_counts, exp_total_row_counts, 2)
+    if len(actual.data) > 1:
+      # Partition row count is expected to not be set.
+      assert all(c == -1 for c in partition_row_counts), partition_row_counts
 
-  def __check_column_stats(self, tbl, expected_tbl):
+  def __check_column_stats(self, client, tbl, expected_tbl):
     """Checks that the NDVs in SHOW COLUMNS STATS on 'tbl' are within 2x of those
     reported for 'expected_tbl'. Assumes that COMPUTE STATS was previously run
     on 'expected_table' and that COMPUTE STATS TABLESAMPLE was run on 'tbl'."""
-    actual = self.client.execute("show column stats {0}".format(tbl))
-    expected = self.client.execute("show column stats {0}".format(expected_tbl))
+    actual = client.execute("show column stats {0}".format(tbl))
+    expected = self.__get_expected_stats(client, "column", tbl, expected_tbl)
     assert len(actual.data) == len(expected.data)
     assert len(actual.schema.fieldSchemas) == len(expected.schema.fieldSchemas)
     col_names = [fs.name.upper() for fs in actual.schema.fieldSchemas]
     ndv_col_idx = col_names.index("#DISTINCT VALUES")
-    for i in xrange(0, len(actual.data)):
-      act_cols = actual.data[i].split("\t")
-      exp_cols = expected.data[i].split("\t")
-      assert int(exp_cols[ndv_col_idx]) >= 0
-      self.appx_equals(int(act_cols[ndv_col_idx]), int(exp_cols[ndv_col_idx]), 2)
+    # Only split off the leading columns that are actually read.
+    max_splits = ndv_col_idx + 1
+    act_ndvs = [int(row.split("\t", max_splits)[ndv_col_idx]) for row in actual.data]
+    exp_ndvs = [int(row.split("\t", max_splits)[ndv_col_idx]) for row in expected.data]
+    assert all(ndv >= 0 for ndv in exp_ndvs), exp_ndvs
+    self.__assert_all_appx_equals(act_ndvs, exp_ndvs, 2)
+
+  def __assert_all_appx_equals(self, actual_vals, expected_vals, diff_perc):
+    """Asserts that each value in 'actual_vals' is within 'diff_perc' percent of the
+    corresponding value in 'expected_vals', with the same semantics as appx_equals().
+    All pairs are checked in one pass and the offending pairs are reported together."""
+    mismatches = [(a, e) for a, e in zip(actual_vals, expected_vals)
+                  if a != e and abs(a - e) / float(max(a, e)) > diff_perc]
+    assert not mismatches, mismatches
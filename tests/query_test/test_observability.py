@@ -17,10 +17,19 @@
 
 from tests.common.impala_test_suite import ImpalaTestSuite
 from tests.common.skip import SkipIfS3, SkipIfADLS, SkipIfIsilon, SkipIfLocal
-from tests.common.impala_cluster import ImpalaCluster
+from collections import defaultdict
 import logging
+import re
 import time
 
+# Matches the first line of a runtime profile containing 'RowsProduced' and captures the
+# row count in parentheses at the end of it.
+ROWS_PRODUCED_PATTERN = re.compile(r'RowsProduced[^\n]*\((\d+)\)')
+# Matches the exec node and sink names whose occurrences are counted in
+# test_profile_fragment_instances().
+PROFILE_NODE_PATTERN = re.compile(
+    r'HDFS_SCAN_NODE|EXCHANGE_NODE|HASH_JOIN_NODE|AGGREGATION_NODE|PLAN_ROOT_SINK')
+
 class TestObservability(ImpalaTestSuite):
   @classmethod
   def get_workload(self):
@@ -38,11 +47,10 @@ class TestObservability(ImpalaTestSuite):
     assert result.exec_summary[0]['num_rows'] == 5
     assert result.exec_summary[0]['est_num_rows'] == 5
 
-    for line in result.runtime_profile.split('\n'):
-      # The first 'RowsProduced' we find is for the coordinator fragment.
-      if 'RowsProduced' in line:
-        assert '(5)' in line
-        break
+    # The first 'RowsProduced' we find is for the coordinator fragment.
+    match = ROWS_PRODUCED_PATTERN.search(result.runtime_profile)
+    assert match is not None, result.runtime_profile
+    assert match.group(1) == '5', match.group(0)
 
   def test_broadcast_num_rows(self):
     """Regression test for IMPALA-3002 - checks that the num_rows for a broadcast node
@@ -121,16 +129,18 @@ class TestObservability(ImpalaTestSuite):
         with l as (select * from tpch.lineitem UNION ALL select * from tpch.lineitem)
         select STRAIGHT_JOIN count(*) from (select * from tpch.lineitem a LIMIT 1) a
         join (select * from l LIMIT 2000000) b on a.l_orderkey = -b.l_orderkey;""")
+    # Count the occurrences of all node names in a single pass over the profile.
+    node_counts = defaultdict(int)
+    for node in PROFILE_NODE_PATTERN.findall(results.runtime_profile):
+      node_counts[node] += 1
     # There are 3 scan nodes and each appears in the profile 4 times (for 3 fragment
     # instances + the averaged fragment).
-    assert results.runtime_profile.count("HDFS_SCAN_NODE") == 12
     # There are 3 exchange nodes and each appears in the profile 2 times (for 1 fragment
     # instance + the averaged fragment).
-    assert results.runtime_profile.count("EXCHANGE_NODE") == 6
-    # The following appear only in the root fragment which has 1 instance.
-    assert results.runtime_profile.count("HASH_JOIN_NODE") == 2
-    assert results.runtime_profile.count("AGGREGATION_NODE") == 2
-    assert results.runtime_profile.count("PLAN_ROOT_SINK") == 2
+    # The hash join, aggregation and plan root sink appear only in the root fragment
+    # which has 1 instance.
+    assert node_counts == {"HDFS_SCAN_NODE": 12, "EXCHANGE_NODE": 6,
+        "HASH_JOIN_NODE": 2, "AGGREGATION_NODE": 2, "PLAN_ROOT_SINK": 2}, node_counts
 
   def test_query_profile_thrift_timestamps(self):
     """Test that the query profile start and end time date-time strings have
@@ -140,38 +150,46 @@ class TestObservability(ImpalaTestSuite):
     handle = self.client.execute_async(query)
     query_id = handle.get_handle().id
     results = self.client.fetch(query, handle)
-    self.client.close()
+    # Close only the query, so that its final profile is produced, and not the client,
+    # which is shared with the other tests of this class.
+    self.client.close_query(handle)
 
     start_time_sub_sec_str = ""
     end_time_sub_sec_str = ""
     start_time = ""
     end_time = ""
 
-    MAX_RETRIES = 60
-    for retries in xrange(MAX_RETRIES):
+    # Poll the debug web page with exponential backoff, starting at 50ms and capped at
+    # 1s per attempt, until the profile shows up or MAX_WAIT_S seconds have passed.
+    MAX_WAIT_S = 60
+    total_wait_s = 0.0
+    retries = 0
+    while total_wait_s < MAX_WAIT_S:
       tree = self.impalad_test_service.get_thrift_profile(query_id)
 
-      if tree is None:
-        continue
-      # tree.nodes[1] corresponds to ClientRequestState::summary_profile_
-      # See be/src/service/client-request-state.[h|cc].
-      start_time = tree.nodes[1].info_strings["Start Time"]
-      end_time = tree.nodes[1].info_strings["End Time"]
-      # Start and End Times are of the form "2017-12-07 22:26:52.167711000"
-      start_time_sub_sec_str = start_time.split('.')[-1]
-      end_time_sub_sec_str = end_time.split('.')[-1]
-      if len(end_time_sub_sec_str) == 0:
+      if tree is not None:
+        # tree.nodes[1] corresponds to ClientRequestState::summary_profile_
+        # See be/src/service/client-request-state.[h|cc].
+        start_time = tree.nodes[1].info_strings["Start Time"]
+        end_time = tree.nodes[1].info_strings["End Time"]
+        # Start and End Times are of the form "2017-12-07 22:26:52.167711000"
+        start_time_sub_sec_str = start_time.split('.')[-1]
+        end_time_sub_sec_str = end_time.split('.')[-1]
+        if len(end_time_sub_sec_str) > 0:
+          assert len(end_time_sub_sec_str) == 9, end_time
+          assert len(start_time_sub_sec_str) == 9, start_time
+          return True
         logging.info('end_time_sub_sec_str hasn\'t shown up yet, retries=%d', retries)
-        time.sleep(1)
-        continue
-      assert len(end_time_sub_sec_str) == 9, end_time
-      assert len(start_time_sub_sec_str) == 9, start_time
-      return True
+
+      sleep_s = min(1.0, 0.05 * (1.5 ** retries))
+      time.sleep(sleep_s)
+      total_wait_s += sleep_s
+      retries += 1
 
     # If we're here, we didn't get the final thrift profile from the debug web page.
     # This could happen due to heavy system load. The test is then inconclusive.
     # Log a message and fail this run.
     dbg_str = 'Debug thrift profile for query ' + str(query_id) + ' not available in '
-    dbg_str += str(MAX_RETRIES) + ' seconds, '
+    dbg_str += str(MAX_WAIT_S) + ' seconds, '
     dbg_str += '(' + start_time + ', ' + end_time + ').'
     assert False, dbg_str